@@ -1,82 +1,167 @@
-import os
+import asyncio
+from collections import Counter
+from typing import Optional
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from app.services.message_codec import MessageCodec
 from app.services.python_executor import PythonExecutor
-import json
 import logging
-from dotenv import load_dotenv
+from app import config
 
-# Load environment variables
-load_dotenv()
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 class ConnectionManager:
+    # Upper bound on queued outgoing frames per connection; puts block
+    # (backpressure) once a slow client falls this far behind
+    SEND_QUEUE_SIZE = 1024
+    # Connection caps so abusive reconnect loops can't grow memory
+    MAX_CONNECTIONS = config.MAX_CONNECTIONS
+    MAX_CONNECTIONS_PER_IP = config.MAX_CONNECTIONS_PER_IP
+
     def __init__(self):
-        self.active_connections: list[WebSocket] = []
+        self.active_connections: set[WebSocket] = set()
+        self.codecs: dict[WebSocket, MessageCodec] = {}
+        self.send_queues: dict[WebSocket, asyncio.Queue] = {}
+        self.writer_tasks: dict[WebSocket, asyncio.Task] = {}
+        self.connections_per_ip: Counter = Counter()
+        # Connections whose writer hit a send error (client vanished);
+        # frames for these are dropped instead of queued
+        self.dead_connections: set[WebSocket] = set()
+
+    async def connect(self, websocket: WebSocket) -> Optional[MessageCodec]:
+        """Accept the connection, or refuse it (returning None) if a cap is hit"""
+        client_host = websocket.client.host if websocket.client else "unknown"
+        if (len(self.active_connections) >= self.MAX_CONNECTIONS
+                or self.connections_per_ip[client_host] >= self.MAX_CONNECTIONS_PER_IP):
+            # 1013: try again later
+            await websocket.close(code=1013)
+            logger.warning(f"Refused WebSocket connection from {client_host}: connection limit reached")
+            return None
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+        codec = MessageCodec.negotiate(websocket)
+        await websocket.accept(subprotocol=codec.subprotocol)
+        self.active_connections.add(websocket)
+        self.connections_per_ip[client_host] += 1
+        self.codecs[websocket] = codec
+        # One writer task per connection drains a queue of encoded frames,
+        # so every producer enqueues instead of racing on send_bytes
+        queue = asyncio.Queue(maxsize=self.SEND_QUEUE_SIZE)
+        self.send_queues[websocket] = queue
+        self.writer_tasks[websocket] = asyncio.create_task(self._write_loop(websocket, queue))
         logger.info(f"WebSocket connected. Total connections: {len(self.active_connections)}")
+        return codec
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        self.active_connections.discard(websocket)
+        client_host = websocket.client.host if websocket.client else "unknown"
+        self.connections_per_ip[client_host] -= 1
+        if self.connections_per_ip[client_host] <= 0:
+            del self.connections_per_ip[client_host]
+        self.codecs.pop(websocket, None)
+        self.send_queues.pop(websocket, None)
+        self.dead_connections.discard(websocket)
+        writer_task = self.writer_tasks.pop(websocket, None)
+        if writer_task:
+            writer_task.cancel()
         logger.info(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+    async def enqueue(self, websocket: WebSocket, data: bytes):
+        """Queue an already-encoded frame for the connection's writer task"""
+        if websocket in self.dead_connections:
+            return
+        queue = self.send_queues.get(websocket)
+        if queue is not None:
+            await queue.put(data)
+
+    async def send_personal_message(self, message: dict, websocket: WebSocket):
+        await self.enqueue(websocket, self.codecs[websocket].encode(message))
+
+    async def _write_loop(self, websocket: WebSocket, queue: asyncio.Queue):
+        try:
+            while True:
+                data = await queue.get()
+                await websocket.send_bytes(data)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error writing to WebSocket: {e}")
+            # The client is gone but an execution may still be producing
+            # output. Mark the connection dead so enqueue drops new frames,
+            # and keep draining the queue so a producer already blocked in
+            # put() resumes instead of hanging the execution forever.
+            # disconnect() cancels this task once the endpoint exits.
+            self.dead_connections.add(websocket)
+            try:
+                while True:
+                    await queue.get()
+            except asyncio.CancelledError:
+                pass
 
 manager = ConnectionManager()
 
 @router.websocket("/python")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
-    executor = PythonExecutor()
-    
+    codec = await manager.connect(websocket)
+    if codec is None:
+        return
+
+    async def send(data: bytes):
+        await manager.enqueue(websocket, data)
+
+    executor = PythonExecutor(codec=codec, sender=send)
+
     try:
         while True:
-            # Wait for message from client
-            data = await websocket.receive_text()
-            
+            # Wait for message from client. Accept binary or text frames:
+            # binary skips Starlette's UTF-8 validation pass (the decoder
+            # validates anyway), text stays for older clients
+            event = await websocket.receive()
+            if event.get("type") == "websocket.disconnect":
+                raise WebSocketDisconnect(event.get("code") or 1000)
+            data = event["bytes"] if event.get("bytes") is not None else event.get("text", "")
+
             try:
-                message = json.loads(data)
+                message = codec.decode(data)
                 code = message.get("code", "")
                 message_type = message.get("type", "execute")
-                
+
                 if message_type == "execute" and code:
                     # Validate code length
-                    max_length = int(os.getenv("MAX_CODE_LENGTH", 3000))
-                    if len(code) > max_length:
+                    if len(code) > config.MAX_CODE_LENGTH:
                         await manager.send_personal_message(
-                            json.dumps({
-                                "type": "error", 
-                                "message": f"{len(code)} charactersis greater than the {max_length} characters allowed. Please submit a shorter string."
-                            }),
+                            {
+                                "type": "error",
+                                "message": f"{len(code)} charactersis greater than the {config.MAX_CODE_LENGTH} characters allowed. Please submit a shorter string."
+                            },
                             websocket
                         )
                         continue
-                    
+
                     # Execute Python code and stream results
                     await executor.execute_and_stream(code, websocket)
                 else:
                     await manager.send_personal_message(
-                        json.dumps({"type": "error", "message": "Message format is invalid. Please send JSON with 'type' and 'code' fields."}),
+                        {"type": "error", "message": "Message format is invalid. Please send JSON with 'type' and 'code' fields."},
                         websocket
                     )
-                    
-            except json.JSONDecodeError:
+
+            except ValueError:
                 await manager.send_personal_message(
-                    json.dumps({"type": "error", "message": "Invalid JSON format. Please send properly formatted JSON data."}),
+                    {"type": "error", "message": "Invalid message format. Please send properly encoded JSON or MessagePack data."},
                     websocket
                 )
             except Exception as e:
                 logger.error(f"Error processing message: {e}")
                 await manager.send_personal_message(
-                    json.dumps({"type": "error", "message": f"Server error occurred: {str(e)}. Please try again or contact support if the problem persists."}),
+                    {"type": "error", "message": f"Server error occurred: {str(e)}. Please try again or contact support if the problem persists."},
                     websocket
                 )
-                
+
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
         logger.info("WebSocket disconnected")
+    finally:
+        # Always release the connection's slot and writer, even when the
+        # endpoint exits through an abrupt transport error rather than a
+        # clean disconnect frame
+        manager.disconnect(websocket)
@@ -0,0 +1,39 @@
+import os
+
+from dotenv import load_dotenv
+
+# Load environment variables exactly once for the whole app. Every module
+# that needs configuration imports this instead of calling load_dotenv()
+# itself, so the .env file is parsed a single time at import.
+load_dotenv()
+
+# Settings read on hot paths are parsed here once, rather than paying an
+# environ lookup plus int() per message or per connection.
+
+# CORS Configuration. A frozenset makes the middleware's per-request
+# origin membership check O(1) instead of a list scan, and stray
+# whitespace around the comma-separated entries is dropped.
+ALLOWED_ORIGINS = frozenset(
+    origin.strip()
+    for origin in os.getenv("ALLOWED_ORIGINS", "http://localhost:5173").split(",")
+    if origin.strip()
+)
+
+# Python Execution Settings
+PYTHON_EXECUTION_TIMEOUT = int(os.getenv("PYTHON_EXECUTION_TIMEOUT", 30))
+MAX_CODE_LENGTH = int(os.getenv("MAX_CODE_LENGTH", 3000))
+EXECUTOR_POOL_SIZE = int(os.getenv("EXECUTOR_POOL_SIZE", 4))
+# Seconds to serve identical deterministic submissions from cache (0 disables)
+EXECUTOR_CACHE_TTL = int(os.getenv("EXECUTOR_CACHE_TTL", 30))
+# Cap on simultaneously running user processes across all connections
+EXECUTOR_MAX_CONCURRENCY = int(os.getenv("EXECUTOR_MAX_CONCURRENCY", 16))
+# Total output one execution may send to the client before truncation
+EXECUTOR_MAX_OUTPUT_BYTES = int(os.getenv("EXECUTOR_MAX_OUTPUT_BYTES", 1024 * 1024))
+# Answer pure constant print() programs in-process (set 0 to force workers)
+EXECUTOR_FAST_PATH = os.getenv("EXECUTOR_FAST_PATH", "1") == "1"
+# How many output lines to process before yielding the event loop
+EXECUTOR_YIELD_EVERY = int(os.getenv("EXECUTOR_YIELD_EVERY", 1000))
+
+# Security Settings
+MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", 1000))
+MAX_CONNECTIONS_PER_IP = int(os.getenv("MAX_CONNECTIONS_PER_IP", 5))
@@ -1,22 +1,32 @@
 import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from app.api.websocket import router as websocket_router
-from dotenv import load_dotenv
+from app.services.process_pool import process_pool
+from app import config  # noqa: F401  (loads .env once)
 
-# Load environment variables
-load_dotenv()
+
+# Use libuv's event loop; socket and subprocess I/O are this service's
+# hot path and uvloop handles both significantly faster than the default.
+# uvloop doesn't build on Windows, so fall back to the stock loop there.
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    uvloop = None
 
 app = FastAPI(
     title="Python Sandbox API",
     description="A WebSocket-based Python execution sandbox for learning",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Enable CORS for specific frontend domains
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=os.getenv("ALLOWED_ORIGINS", "http://localhost:5173").split(","),
+    allow_origins=config.ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
@@ -25,6 +35,16 @@ app.add_middleware(
 # Include WebSocket routes
 app.include_router(websocket_router, prefix="/ws", tags=["websocket"])
 
+@app.on_event("startup")
+async def warm_process_pool():
+    # Pre-spawn interpreter workers so the first execution doesn't pay
+    # pool startup either
+    await process_pool.start()
+
+@app.on_event("shutdown")
+async def stop_process_pool():
+    await process_pool.shutdown()
+
 @app.get("/")
 async def root():
     return {"message": "Python Sandbox API is running"}
@@ -35,8 +55,11 @@ async def health_check():
 
 if __name__ == "__main__":
     import uvicorn
+    # Executions are independent, so throughput scales across workers.
+    # Multi-worker mode needs the app as an import string, not an object.
     uvicorn.run(
-        app, 
-        host=os.getenv("HOST", "0.0.0.0"), 
-        port=int(os.getenv("PORT", 8080))
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", 8080)),
+        workers=int(os.getenv("UVICORN_WORKERS", os.cpu_count() or 1))
     )